@@ -1,103 +1,191 @@
+import io
 import os
 import sys
+import atexit
+import queue
 import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
 import streamlit as st
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional, Tuple
 from datetime import datetime
 
 # Fix Python path for imports
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
+@st.cache_resource(show_spinner=False)
+def _start_log_listener() -> QueueListener:
+    """Route log records through a queue so file/console writes happen off the request thread"""
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(
+        log_queue,
         logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
-)
+        logging.StreamHandler(),
+        respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[QueueHandler(log_queue)]
+    )
+    return listener
+
+# Configure logging (once per process, Streamlit reruns this script)
+_start_log_listener()
 logger = logging.getLogger(__name__)
 
+# Silence per-call INFO chatter from third-party libraries
+for _name in ("sentence_transformers", "httpx"):
+    logging.getLogger(_name).setLevel(logging.WARNING)
+
 try:
     from utils.retrieval import VectorDB
     from utils.generation import ResponseGenerator
     from utils.file_processor import FileProcessor  
-    from config import Config
+    from config import get_config
 except ImportError as e:
-    logger.critical(f"Import error: {str(e)}")
+    logger.critical("Import error: %s", str(e))
     st.error("System configuration error. Please check logs.")
     st.stop()
 
-@st.cache_resource
-def initialize_components():
-    """Initialize and cache RAG components"""
+# Max characters of each retrieved document passed to the model
+_CTX_LIMIT = 1500
+# Leading characters compared when dropping duplicate chunks
+_DEDUPE_PREFIX = 128
+# Bound %-formatter for one context entry: (source, text, ellipsis)
+_CTX_FORMAT = "📄 %s:\n%s%s".__mod__
+
+@st.cache_resource(show_spinner=False)
+def load_components() -> Tuple[VectorDB, ResponseGenerator, Callable[[str], Optional[str]]]:
+    """Build and cache RAG components (raises on failure, so failures are not cached)"""
+    logger.info("Initializing system components...")
+    config = get_config()
+    
+    # Initialize VectorDB
+    logger.info("Setting up Vector Database...")
+    vector_db = VectorDB()
+    
+    if not vector_db.load_or_create_index():
+        raise RuntimeError("VectorDB initialization failed")
+    
+    # Initialize Response Generator
+    logger.info("Initializing AI Generator...")
+    generator = ResponseGenerator(
+        api_key=config.GEMINI_API_KEY,
+        model=config.GEMINI_MODEL,
+        transport=config.GEMINI_TRANSPORT,
+        max_retries=config.MAX_RETRIES,
+        retry_delay=config.RETRY_DELAY,
+        embedder=vector_db.embedder,
+        cache_threshold=config.RESPONSE_CACHE_THRESHOLD,
+        cache_size=config.RESPONSE_CACHE_SIZE,
+        cache_ttl=config.RESPONSE_CACHE_TTL,
+        batch_mode=config.USE_BATCH_MODE,
+        warmup=config.WARMUP,
+        encode_query=vector_db.embed_query
+    )
+    
+    # Retrieval + formatting specialized for this index and top_k
+    pipeline = build_pipeline(vector_db, config.TOP_K)
+    
+    logger.info("All components initialized successfully")
+    return vector_db, generator, pipeline
+
+def initialize_components() -> Tuple[VectorDB, ResponseGenerator, Callable[[str], Optional[str]]]:
+    """Return the cached RAG components, stopping the app if they fail to load"""
     try:
-        logger.info("Initializing system components...")
-        config = Config()
-        
-        # Initialize VectorDB
-        logger.info("Setting up Vector Database...")
-        vector_db = VectorDB()
-        
-        if not vector_db.load_or_create_index():
-            raise RuntimeError("VectorDB initialization failed")
-        
-        # Initialize Response Generator
-        logger.info("Initializing AI Generator...")
-        generator = ResponseGenerator(
-            api_key=config.GEMINI_API_KEY,
-            model=config.GEMINI_MODEL
-        )
-        
-        logger.info("All components initialized successfully")
-        return vector_db, generator
-        
+        return load_components()
     except Exception as e:
-        logger.critical(f"Component initialization failed: {str(e)}")
+        logger.critical("Component initialization failed: %s", str(e))
         st.error("System startup failed. Please contact support.")
         st.stop()
 
-def retrieve_documents(vector_db: VectorDB, query: str) -> Dict:
+def _warm_components():
+    try:
+        load_components()
+    except Exception as e:
+        logger.error("Background warm-up failed: %s", str(e))
+
+@st.cache_resource(show_spinner=False)
+def _start_background_warmup() -> threading.Thread:
+    """Load components in a daemon thread, once per process"""
+    thread = threading.Thread(target=_warm_components, name="rag-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def retrieve_documents(vector_db: VectorDB, query: str, top_k: int = 3) -> Dict:
     """Retrieve relevant documents with error handling"""
     try:
-        logger.info(f"Retrieving documents for query: {query[:50]}...")
-        results = vector_db.query(query, top_k=3)
+        logger.info("Retrieving documents for query: %.50s...", query)
+        # VectorDB caches exact and near-duplicate queries per index generation
+        results = vector_db.query(query, k=top_k)
         
         if not results['documents']:
             logger.warning("No documents found for query")
             return None
             
-        logger.info(f"Retrieved {len(results['documents'])} relevant documents")
+        logger.info("Retrieved %d relevant documents", len(results['documents']))
         return results
         
     except Exception as e:
-        logger.error(f"Document retrieval failed: {str(e)}")
+        logger.error("Document retrieval failed: %s", str(e))
         return None
 
+def dedupe_chunks(docs: List[str], metas: List[Dict]) -> Tuple[List[str], List[Dict]]:
+    """Drop retrieved chunks whose leading text repeats an earlier chunk"""
+    seen = set()
+    unique_docs, unique_metas = [], []
+    for text, meta in zip(docs, metas):
+        key = text[:_DEDUPE_PREFIX]
+        if key in seen:
+            continue
+        seen.add(key)
+        unique_docs.append(text)
+        unique_metas.append(meta)
+    if len(unique_docs) < len(docs):
+        logger.info("Dropped %d duplicate chunks from context", len(docs) - len(unique_docs))
+    return unique_docs, unique_metas
+
 def generate_context(retrieved: Dict) -> str:
     """Format retrieved documents into context"""
-    context_parts = []
-    for i, (text, meta) in enumerate(zip(retrieved['documents'], retrieved['metadatas'])):
-        source = meta.get('source', f"Document {i+1}")
-        context_parts.append(
-            f"📄 {source}:\n"
-            f"{text[:1500]}{'...' if len(text) > 1500 else ''}"
-        )
-    return "\n\n".join(context_parts)
+    docs, metas = dedupe_chunks(retrieved['documents'], retrieved['metadatas'])
+    buf = io.StringIO()
+    write = buf.write
+    for i, (text, meta) in enumerate(zip(docs, metas)):
+        if i:
+            write("\n\n")
+        # Chunks that recorded their length can skip the len() check
+        truncated = (meta.get('chunk_len') or len(text)) > _CTX_LIMIT
+        write(_CTX_FORMAT((
+            meta.get('source') or f"Document {i+1}",
+            text[:_CTX_LIMIT] if truncated else text,
+            "..." if truncated else ""
+        )))
+    return buf.getvalue()
+
+def build_pipeline(vector_db: VectorDB, top_k: int) -> Callable[[str], Optional[str]]:
+    """Bind retrieval and context formatting to a fixed VectorDB and top_k"""
+    retrieve, format_context = retrieve_documents, generate_context
+
+    def retrieve_and_format(query: str) -> Optional[str]:
+        retrieved = retrieve(vector_db, query, top_k)
+        return format_context(retrieved) if retrieved else None
+
+    return retrieve_and_format
 
 def main():
     # App configuration
+    config = get_config()
     st.set_page_config(
-        page_title="IQRA University - Virtual Office Platform",
-        page_icon="📚",
+        page_title=config.PAGE_TITLE,
+        page_icon=config.PAGE_ICON,
         layout="centered",
         initial_sidebar_state="expanded"
     )
     
-    # Initialize components
-    vector_db, generator = initialize_components()
-    
     # Session state initialization
     if "messages" not in st.session_state:
         st.session_state.messages = []
@@ -136,21 +224,30 @@ def main():
         with st.chat_message("user", avatar="👤"):
             st.markdown(prompt)
         
+        # Components load in the background while the page renders
+        with st.spinner("Loading knowledge base..."):
+            _, generator, pipeline = initialize_components()
+        
         # Generate response
         with st.chat_message("assistant", avatar="🤖"):
             try:
                 with st.spinner("Searching documents..."):
-                    retrieved = retrieve_documents(vector_db, prompt)
-                    
-                    if not retrieved:
-                        response = "No relevant documents found."
-                        st.markdown(response)
-                    else:
-                        context = generate_context(retrieved)
-                        with st.spinner("Generating response..."):
-                            response = generator.generate(prompt, context)
-                            st.markdown(response)
-                
+                    context = pipeline(prompt)
+
+                if not context:
+                    response = "No relevant documents found."
+                    st.markdown(response)
+                else:
+                    # Render tokens as they arrive; write_stream returns the full text
+                    placeholder = st.empty()
+                    with placeholder.container():
+                        streamed = st.write_stream(generator.generate_stream(prompt, context))
+
+                    # Validation needs the whole answer, so it runs after streaming
+                    response = generator.finalize_stream(streamed, prompt, context)
+                    if response != streamed:
+                        placeholder.markdown(response)
+
                 # Add assistant response to history
                 st.session_state.messages.append({
                     "role": "assistant", 
@@ -159,9 +256,12 @@ def main():
                 })
                 
             except Exception as e:
-                logger.error(f"Chat error: {str(e)}")
+                logger.error("Chat error: %s", str(e))
                 st.error("An error occurred. Please try again.")
 
+# Start loading models and the index before the first question arrives
+_start_background_warmup()
+
 if __name__ == "__main__":
     main()
 # this above is a code for stream lit
@@ -1,26 +1,106 @@
 import os
-import streamlit as st
 import logging
+from dataclasses import dataclass
+import functools
+import streamlit as st
+from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
 
+# Callers share the get_config() instance rather than constructing Config
+__all__ = ["Config", "get_config"]
+
+def _env(key: str, default):
+    """Read an override from the process environment, cast to the default's type"""
+    value = os.getenv(key)
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return type(default)(value)
+
+# The frozen, slotted dataclass keeps no per-instance dict; defaults (including
+# environment overrides) are evaluated once at import
+@dataclass(frozen=True, slots=True)
 class Config:
-    # Class variables (constants)
-    EMBEDDING_MODEL = "all-MiniLM-L6-v2"
-    GEMINI_MODEL = "gemini-3-flash-preview"
-    VECTOR_DB_PATH = "knowledge_base/faiss_db"
-    DOCUMENTS_PATH = "knowledge_base/documents"
-    
-    # Instance variables (for secrets)
-    def __init__(self):
-        self.GEMINI_API_KEY = self._get_secret("GEMINI_API_KEY")
-        
-    def _get_secret(self, key: str) -> str:
-        try:
-            return st.secrets[key] or os.getenv(key)
-        except Exception as e:
-            logger.critical(f"Missing {key}: {str(e)}")
-            raise
+    # Constants
+    EMBEDDING_MODEL: str = _env("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+    EMBEDDING_BACKEND: str = _env("EMBEDDING_BACKEND", "onnx")
+    # ONNX file within the model repo; empty picks the int8 export for this CPU
+    EMBEDDING_ONNX_FILE: str = _env("EMBEDDING_ONNX_FILE", "")
+    GEMINI_MODEL: str = _env("GEMINI_MODEL", "gemini-3-flash-preview")
+    GEMINI_TRANSPORT: str = _env("GEMINI_TRANSPORT", "grpc")
+    VECTOR_DB_PATH: str = _env("VECTOR_DB_PATH", "knowledge_base/faiss_db")
+    DOCUMENTS_PATH: str = _env("DOCUMENTS_PATH", "knowledge_base/documents")
+    TOP_K: int = _env("TOP_K", 3)
+    CHUNK_SIZE: int = _env("CHUNK_SIZE", 256)
+    CHUNK_OVERLAP: int = _env("CHUNK_OVERLAP", 32)
+    MAX_RETRIES: int = _env("MAX_RETRIES", 3)
+    RETRY_DELAY: float = _env("RETRY_DELAY", 1.0)
+    # Bulk (non-interactive) generation goes through the discounted Batch API
+    USE_BATCH_MODE: bool = _env("USE_BATCH_MODE", False)
+    # Exercise the encoder, index and Gemini channel at startup, off the first query
+    WARMUP: bool = _env("WARMUP", True)
+    PAGE_TITLE: str = _env("PAGE_TITLE", "IQRA University - Virtual Office Platform")
+    PAGE_ICON: str = _env("PAGE_ICON", "📚")
+    QUERY_CACHE_THRESHOLD: float = 0.97
+    QUERY_CACHE_SIZE: int = 512
+    EMBED_CACHE_SIZE: int = 4096
+    RESULT_CACHE_SIZE: int = 1024
+    RESPONSE_CACHE_THRESHOLD: float = 0.95
+    RESPONSE_CACHE_SIZE: int = 256
+    RESPONSE_CACHE_TTL: float = 3600.0
+    # "auto" picks flat/sq8/hnsw/ivfpq by corpus size; or force one, or "pq"
+    FAISS_INDEX_TYPE: str = _env("FAISS_INDEX_TYPE", "auto")
+    FAISS_INDEX_FACTORY: str = "OPQ48,IVF1024,PQ48"
+    FAISS_PQ_INDEX_FACTORY: str = "PQ48"
+    FAISS_NPROBE: int = 16
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_CONSTRUCTION: int = 200
+    FAISS_HNSW_EF_SEARCH: int = 64
+    RERANK_OVERFETCH: int = 4
+    FAISS_SQ_THRESHOLD: int = 1_000
+    FAISS_HNSW_THRESHOLD: int = 10_000
+    FAISS_IVF_THRESHOLD: int = 100_000
+
+    # Secrets (resolved on first access)
+    @property
+    def GEMINI_API_KEY(self) -> str:
+        return _get_secret("GEMINI_API_KEY")
+
+@functools.cache
+def _load_dotenv():
+    load_dotenv()
+
+@functools.cache
+def _secrets_available() -> bool:
+    # Probe once; without a secrets.toml every st.secrets access would raise
+    try:
+        return bool(st.secrets.load_if_toml_exists())
+    except Exception as e:
+        logger.debug("st.secrets unavailable: %s", str(e))
+        return False
+
+@functools.cache
+def _get_secret(key: str) -> str:
+    value = st.secrets.get(key) if _secrets_available() else None
+
+    if not value:
+        _load_dotenv()
+        value = os.getenv(key)
+    if not value:
+        logger.critical("Missing %s in st.secrets and environment", key)
+        raise KeyError(key)
+    return value
+
+@functools.lru_cache(maxsize=1)
+def get_config() -> Config:
+    """Build the application config once per process"""
+    logger.info("Loading configuration...")
+    config = Config()
+    logger.info("Configuration loaded with model %s and embedding %s",
+               config.GEMINI_MODEL, config.EMBEDDING_MODEL)
+    return config
 
     # this is the above code for the stremlit
 
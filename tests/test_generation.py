@@ -0,0 +1,27 @@
+import pytest
+
+# utils.generation pulls these in directly or through config and utils.cache
+for _module in ("google.generativeai", "streamlit", "dotenv", "faiss", "numpy"):
+    pytest.importorskip(_module)
+
+from utils.generation import ResponseGenerator
+
+
+@pytest.fixture
+def generator():
+    # validate_response needs no model or API key, so skip __init__
+    return object.__new__(ResponseGenerator)
+
+
+@pytest.mark.parametrize("text, query", [
+    ("Apply as an aide or as an AIESEC member.", "apply aide member"),
+    ("She was hired as an aid.", "hired aid"),
+])
+def test_validate_response_leaves_similar_words_alone(generator, text, query):
+    assert generator.validate_response(text, query) == text
+
+
+def test_validate_response_replaces_whole_phrases(generator):
+    text = "As a rule, as an AI I think fees are typically paid in general."
+    assert generator.validate_response(text, "fees paid") == \
+        "As a rule,  I think fees are in this case paid specifically."
@@ -0,0 +1,169 @@
+import os
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """Thread-safe exact-key LRU cache"""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class QueryCache:
+    """Semantic LRU cache mapping query embeddings to previously computed results"""
+
+    # Neighbours inspected per lookup, so entries with a different key don't hide a match
+    _SEARCH_K = 4
+
+    def __init__(self, path: Optional[str] = None, dim: int = 384,
+                 threshold: float = 0.97, max_entries: int = 512,
+                 ttl: Optional[float] = None):
+        """
+        Initialize the cache, loading a persisted copy from path if present
+
+        Args:
+            path: Directory the cache is persisted to (None keeps it in memory only);
+                persisted keys and values must be JSON-serializable
+            dim: Embedding dimension
+            threshold: Minimum cosine similarity for a cache hit
+            max_entries: Entries kept before the least recently used are evicted
+            ttl: Seconds an entry stays valid (None never expires)
+        """
+        self.path = path
+        self.dim = dim
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._reset()
+        if path:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def lookup(self, embedding: np.ndarray, key: Hashable = None) -> Optional[Any]:
+        """Return the cached value for the most similar query with the same key"""
+        query = self._normalize(embedding)
+        with self._lock:
+            if self.index.ntotal == 0:
+                return None
+            sims, ids = self.index.search(query, min(self._SEARCH_K, self.index.ntotal))
+            for sim, idx in zip(sims[0], ids[0]):
+                if idx < 0 or sim < self.threshold:
+                    break
+                if self._keys[idx] == key and not self._expired(idx):
+                    logger.debug("Query cache hit (similarity %.3f)", sim)
+                    return self._promote(int(idx))
+        return None
+
+    def add(self, embedding: np.ndarray, value: Any, key: Hashable = None):
+        """Store a value for a query embedding, evicting the oldest entries"""
+        vector = self._normalize(embedding)
+        with self._lock:
+            self.index.add(vector)
+            self._keys.append(key)
+            self._values.append(value)
+            self._times.append(time.time())
+
+            overflow = len(self._values) - self.max_entries
+            if overflow > 0:
+                # Flat indexes renumber on removal, keeping ids aligned with the lists
+                self.index.remove_ids(faiss.IDSelectorRange(0, overflow))
+                del self._keys[:overflow]
+                del self._values[:overflow]
+                del self._times[:overflow]
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+        logger.debug("Query cache cleared")
+
+    def save(self):
+        """Persist the cache so it survives process restarts"""
+        if not self.path:
+            return
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with self._lock:
+                faiss.write_index(self.index, os.path.join(self.path, "index.faiss"))
+                # JSON rather than pickle, so loading a cache file can't run code
+                with open(os.path.join(self.path, "entries.json"), 'w', encoding='utf-8') as f:
+                    json.dump({"keys": self._keys, "values": self._values, "times": self._times}, f)
+            logger.info("Saved query cache with %d entries to %s", len(self), self.path)
+        except Exception as e:
+            logger.error("Failed saving query cache: %s", str(e))
+
+    def _load(self):
+        index_path = os.path.join(self.path, "index.faiss")
+        entries_path = os.path.join(self.path, "entries.json")
+        if not (os.path.exists(index_path) and os.path.exists(entries_path)):
+            return
+        try:
+            index = faiss.read_index(index_path)
+            with open(entries_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            keys, values, times = entries["keys"], entries["values"], entries["times"]
+            if index.d != self.dim or not index.ntotal == len(keys) == len(values) == len(times):
+                raise ValueError("Cache index and entries are out of sync")
+            self.index, self._keys, self._values, self._times = index, keys, values, times
+            logger.info("Loaded query cache with %d entries", len(values))
+        except Exception as e:
+            logger.error("Failed loading query cache: %s", str(e))
+            self._reset()
+
+    def _reset(self):
+        self.index = faiss.IndexFlatIP(self.dim)
+        self._keys = []
+        self._values = []
+        self._times = []
+
+    def _expired(self, idx: int) -> bool:
+        return self.ttl is not None and time.time() - self._times[idx] > self.ttl
+
+    def _promote(self, idx: int) -> Any:
+        """Move a hit to the end of the eviction order (caller holds the lock)"""
+        value = self._values[idx]
+        if idx != len(self._values) - 1:
+            vector = self.index.reconstruct(idx).reshape(1, -1)
+            self.index.remove_ids(faiss.IDSelectorRange(idx, idx + 1))
+            self.index.add(vector)
+            self._keys.append(self._keys.pop(idx))
+            self._values.append(self._values.pop(idx))
+            self._times.append(self._times.pop(idx))
+        return value
+
+    def _normalize(self, embedding: np.ndarray) -> np.ndarray:
+        vector = np.array(embedding, dtype='float32').reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
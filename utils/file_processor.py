@@ -1,120 +1,254 @@
 # logging messages to monitor execution flow.
 import os
-import re
+import codecs
 import logging
+import hashlib
+import functools
+from logging.handlers import MemoryHandler
+from concurrent.futures import ProcessPoolExecutor
 from typing import Optional, List, Dict, Tuple
 from pypdf import PdfReader
 from docx import Document
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('file_processor.log'),
-        logging.StreamHandler()
-    ]
-)
+if not logging.getLogger().handlers:
+    # File writes are batched and the log is only opened once something is written;
+    # logging.shutdown() flushes the buffer at exit
+    _LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    _file_handler = logging.FileHandler('file_processor.log', delay=True)
+    _file_handler.setFormatter(logging.Formatter(_LOG_FORMAT))
+    logging.basicConfig(
+        level=logging.INFO,
+        format=_LOG_FORMAT,
+        handlers=[
+            MemoryHandler(capacity=1000, flushLevel=logging.ERROR, target=_file_handler),
+            logging.StreamHandler()
+        ]
+    )
 logger = logging.getLogger(__name__)
+# pypdf warns on every malformed object it recovers from
+logging.getLogger("pypdf").setLevel(logging.ERROR)
+
+def _flush_log_buffers():
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
+def _init_worker_logging():
+    """Write a pool worker's records straight to the file: a buffer dies with the worker"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, MemoryHandler):
+            # Forked workers start with a copy of the parent's pending records
+            handler.buffer.clear()
+            root.removeHandler(handler)
+            if handler.target is not None:
+                root.addHandler(handler.target)
+
+@functools.cache
+def _ensure_dir(path: str):
+    # makedirs(exist_ok=True) is idempotent; only issue it once per process
+    os.makedirs(path, exist_ok=True)
+
+# Bump whenever an extractor's output changes, so cached text is re-extracted
+_CACHE_VERSION = 2
+
+def _cache_header(source: str, stat: os.stat_result) -> str:
+    return f"{_CACHE_VERSION}\t{stat.st_mtime_ns}\t{stat.st_size}\t{source}\n"
+
+def _memoize_to_disk(func):
+    """Reuse extracted text for files whose path, mtime and size are unchanged"""
+    @functools.wraps(func)
+    def wrapper(self, file_path: str) -> Optional[str]:
+        # The stat for the cache key doubles as the existence check
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            logger.error("File not found: %s", file_path)
+            return None
+
+        # One entry per source path, overwritten when the file or extractor changes
+        source = os.path.abspath(file_path)
+        header = _cache_header(source, stat)
+        cache_path = os.path.join(self._cache_dir, hashlib.blake2b(source.encode()).hexdigest() + ".txt")
+        try:
+            with open(cache_path, 'r', encoding='utf-8', newline='') as f:
+                if f.readline() == header:
+                    logger.debug("  ├ Using cached text for %s", os.path.basename(file_path))
+                    return f.read()
+        except FileNotFoundError:
+            pass
+
+        content = func(self, file_path)
+        if content:
+            try:
+                _ensure_dir(self._cache_dir)
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                    f.write(header)
+                    f.write(content)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                logger.warning("  ├ Could not cache extracted text: %s", str(e))
+        return content
+    return wrapper
+
+def _sniff_encoding(data: bytes) -> str:
+    """Pick the encoding from a leading BOM, defaulting to UTF-8"""
+    if data.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    return 'utf-8'
 
 class FileProcessor:
+    _cache_dir = ".fp_cache"
+    # Extension -> extractor method name, resolved with getattr per call
+    _DISPATCH = {
+        '.pdf': 'extract_text_from_pdf',
+        '.txt': 'extract_text_from_txt',
+        '.docx': 'extract_text_from_docx'
+    }
+    supported_formats = frozenset(_DISPATCH)
+
     def __init__(self):
-        self.supported_formats = ['.pdf', '.txt', '.docx']
+        self.prune_cache()
         logger.info("Initialized FileProcessor supporting: %s", 
-                   ", ".join(self.supported_formats))
+                   ", ".join(self._DISPATCH))
 
-    def _log_processing_start(self, file_path: str, file_type: str):
-        logger.info("┌[START] Processing %s file: %s", 
-                   file_type.upper(), os.path.basename(file_path))
+    def prune_cache(self) -> int:
+        """Delete cached text whose source file is gone or from an older extractor version"""
+        removed = 0
+        try:
+            entries = list(os.scandir(self._cache_dir))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            # Leave writes in progress in other processes alone
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8', newline='') as f:
+                    version, _, _, source = f.readline().rstrip('\n').split('\t', 3)
+                if version == str(_CACHE_VERSION) and os.path.exists(source):
+                    continue
+            except (OSError, ValueError, UnicodeDecodeError):
+                # Unreadable or written before entries carried a header
+                pass
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+        if removed:
+            logger.info("Pruned %d stale entries from %s", removed, self._cache_dir)
+        return removed
 
-    def _log_processing_end(self, file_path: str, success: bool, pages: int = 0):
+    def _log_processing_start(self, name: str, file_type: str):
+        logger.info("┌[START] Processing %s file: %s", file_type.upper(), name)
+
+    def _log_processing_end(self, name: str, success: bool, pages: int = 0):
         status = "SUCCESS" if success else "FAILED"
-        log_msg = f"└[{status}] Processed {os.path.basename(file_path)}"
+        log_msg = f"└[{status}] Processed {name}"
         if pages > 0:
             log_msg += f" ({pages} pages)"
         logger.info(log_msg)
 
     def extract_text_from_pdf(self, file_path: str) -> Optional[str]:
-        self._log_processing_start(file_path, "PDF")
+        name = os.path.basename(file_path)
+        self._log_processing_start(name, "PDF")
         try:
-            reader = PdfReader(file_path)
-            text = ""
-            for i, page in enumerate(reader.pages, 1):
+            # Lenient parsing skips strict-mode validation of malformed objects
+            reader = PdfReader(file_path, strict=False)
+            pages = reader.pages
+            total = len(pages)
+            parts = []
+            _dbg = logger.isEnabledFor(logging.DEBUG)
+            for i, page in enumerate(pages, 1):
                 page_text = page.extract_text()
                 if page_text:
-                    text += re.sub(r'\s+', ' ', page_text).strip() + "\n"
-                if i % 10 == 0 or i == len(reader.pages):
-                    logger.debug("  ├ Processed page %d/%d", i, len(reader.pages))
+                    # split() drops leading/trailing runs, so no strip() is needed
+                    parts.append(" ".join(page_text.split()))
+                if _dbg and (i % 10 == 0 or i == total):
+                    logger.debug("  ├ Processed page %d/%d", i, total)
             
-            self._log_processing_end(file_path, True, len(reader.pages))
-            return text.strip()
+            self._log_processing_end(name, True, total)
+            return "\n".join(parts).strip()
         except Exception as e:
             logger.error("  ├ Error: %s", str(e))
-            self._log_processing_end(file_path, False)
+            self._log_processing_end(name, False)
             return None
 
     def extract_text_from_txt(self, file_path: str) -> Optional[str]:
-        self._log_processing_start(file_path, "TXT")
+        name = os.path.basename(file_path)
+        self._log_processing_start(name, "TXT")
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                char_count = len(content)
-                self._log_processing_end(file_path, True)
-                logger.debug("  ├ Extracted %d characters", char_count)
-                return content
-        except UnicodeDecodeError:
+            # Read once as bytes; a failed UTF-8 decode no longer re-reads the file
+            with open(file_path, 'rb') as f:
+                data = f.read()
             try:
-                with open(file_path, 'r', encoding='latin-1') as f:
-                    content = f.read()
-                    self._log_processing_end(file_path, True)
-                    logger.warning("  ├ Used latin-1 fallback encoding")
-                    return content
-            except Exception as e:
-                logger.error("  ├ Error: %s", str(e))
-                self._log_processing_end(file_path, False)
-                return None
+                content = data.decode(_sniff_encoding(data))
+            except UnicodeDecodeError:
+                content = data.decode('latin-1')
+                logger.warning("  ├ Used latin-1 fallback encoding")
+            if '\r' in content:
+                # Match text-mode reads, which translate newlines
+                content = content.replace('\r\n', '\n').replace('\r', '\n')
+            self._log_processing_end(name, True)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("  ├ Extracted %d characters", len(content))
+            return content
+        except Exception as e:
+            logger.error("  ├ Error: %s", str(e))
+            self._log_processing_end(name, False)
+            return None
 
     def extract_text_from_docx(self, file_path: str) -> Optional[str]:
-        self._log_processing_start(file_path, "DOCX")
+        name = os.path.basename(file_path)
+        self._log_processing_start(name, "DOCX")
         try:
             doc = Document(file_path)
-            paragraphs = [para.text.strip() for para in doc.paragraphs if para.text.strip()]
-            self._log_processing_end(file_path, True)
-            logger.debug("  ├ Extracted %d paragraphs", len(paragraphs))
+            paragraphs = [text for para in doc.paragraphs if (text := para.text.strip())]
+            self._log_processing_end(name, True)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("  ├ Extracted %d paragraphs", len(paragraphs))
             return "\n".join(paragraphs)
         except Exception as e:
             logger.error("  ├ Error: %s", str(e))
-            self._log_processing_end(file_path, False)
+            self._log_processing_end(name, False)
             return None
 
+    @_memoize_to_disk
     def process_file(self, file_path: str) -> Optional[str]:
-        if not os.path.exists(file_path):
-            logger.error("File not found: %s", file_path)
-            return None
-
         file_ext = os.path.splitext(file_path)[1].lower()
         if file_ext not in self.supported_formats:
             logger.error("Unsupported format: %s", file_ext)
             return None
 
-        processors = {
-            '.pdf': self.extract_text_from_pdf,
-            '.txt': self.extract_text_from_txt,
-            '.docx': self.extract_text_from_docx
-        }
-        return processors[file_ext](file_path)
+        return getattr(self, self._DISPATCH[file_ext])(file_path)
 
-    def batch_process(self, directory: str) -> Dict[str, str]:
+    def batch_process(self, directory: str, max_workers: Optional[int] = None) -> Dict[str, str]:
         logger.info("=== Starting batch processing of %s ===", directory)
+        # scandir caches the file type from the directory read, avoiding a stat per entry
+        entries = list(os.scandir(directory))
+        total = len(entries)
+        paths = [entry.path for entry in entries if entry.is_file(follow_symlinks=False)]
+
+        # Extraction is CPU-bound pure Python, so spread files across processes
+        if len(paths) > 1:
+            # Write out buffered records before workers fork with a copy of them
+            _flush_log_buffers()
+            with ProcessPoolExecutor(max_workers=max_workers,
+                                     initializer=_init_worker_logging) as executor:
+                contents = list(executor.map(self.process_file, paths))
+        else:
+            contents = [self.process_file(path) for path in paths]
+
         results = {}
-        for filename in os.listdir(directory):
-            file_path = os.path.join(directory, filename)
-            if os.path.isfile(file_path):
-                content = self.process_file(file_path)
-                if content:
-                    results[filename] = content
+        for path, content in zip(paths, contents):
+            if content:
+                results[os.path.basename(path)] = content
         logger.info("=== Batch complete: %d/%d files processed ===", 
-                   len(results), len(os.listdir(directory)))
+                   len(results), total)
         return results
 
 # from pypdf import PdfReader
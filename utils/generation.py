@@ -1,49 +1,133 @@
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+import re
 import time
+import random
+import asyncio
+import queue
+import atexit
+import hashlib
 import logging
-from typing import Optional
-from config import Config
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('generation.log'),
-        logging.StreamHandler()
-    ]
-)
+from logging.handlers import QueueHandler, QueueListener
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Iterable, Iterator, List, Optional, Tuple
+from config import get_config
+from utils.cache import QueryCache
+
+if TYPE_CHECKING:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+
 logger = logging.getLogger(__name__)
 
+def setup_logging(log_file: Optional[str] = 'generation.log') -> Optional[QueueListener]:
+    """
+    Configure root logging for standalone use of this module
+
+    Importing the module no longer touches logging, so the app (or a test)
+    keeps its own setup. File writes go through a queue listener thread.
+
+    Args:
+        log_file: File to log to, or None for console only
+
+    Returns:
+        The started listener (stop it to flush), or None without a log file
+    """
+    handlers = [logging.StreamHandler()]
+    listener = None
+    if log_file:
+        log_queue = queue.Queue(-1)
+        listener = QueueListener(log_queue, logging.FileHandler(log_file, delay=True))
+        listener.start()
+        atexit.register(listener.stop)
+        handlers.append(QueueHandler(log_queue))
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=handlers
+    )
+    return listener
+
 class ResponseGenerator:
     """Handles response generation using Gemini AI with RAG integration"""
+
+    ERROR_MESSAGE = "⚠️ System error: Please try again later"
+
+    # Common hallucination phrases, replaced as whole words in a single pass
+    _REPLACEMENTS = {
+        "as an AI": "",
+        "I don't have personal opinions": "The documents don't specify",
+        "my knowledge cutoff": "the available documents",
+        "in general": "specifically",
+        "typically": "in this case"
+    }
+    _REPLACEMENT_RE = re.compile(r"\b(?:%s)\b" % "|".join(map(re.escape, _REPLACEMENTS)))
+    # Shared by the realtime model and Batch API requests
+    _SAFETY_SETTINGS = {
+        'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
+        'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE',
+        'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_NONE',
+        'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_NONE'
+    }
     
-    def __init__(self, api_key: str, model: str = "gemini-3-flash-preview"):
+    def __init__(self, api_key: str, model: str = "gemini-3-flash-preview",
+                 transport: str = "grpc", max_retries: int = 3,
+                 retry_delay: float = 1.0, embedder: Optional["SentenceTransformer"] = None,
+                 cache_threshold: float = 0.95, cache_size: int = 256,
+                 cache_ttl: Optional[float] = 3600.0, batch_mode: bool = False,
+                 warmup: bool = False,
+                 encode_query: Optional[Callable[[str], "np.ndarray"]] = None):
         """
         Initialize the response generator
         
         Args:
             api_key: Gemini API key
             model: Name of the Gemini model to use
+            transport: SDK transport; "grpc" keeps one multiplexed HTTP/2
+                channel open for the lifetime of the client
+            max_retries: Default number of attempts for generate()
+            retry_delay: Base delay in seconds for exponential backoff
+            embedder: Shared SentenceTransformer (normally VectorDB.embedder) used
+                to embed queries for the response cache; None disables caching
+            cache_threshold: Minimum query similarity for a cached answer
+            cache_size: Answers kept before the least recently used is evicted
+            cache_ttl: Seconds a cached answer stays valid
+            batch_mode: Route generate_bulk() through the offline Batch API
+            warmup: Open the Gemini channel with ping() before the first request
+            encode_query: Returns the embedding of a query, normally
+                VectorDB.embed_query so retrieval's cached embedding is reused;
+                defaults to encoding with embedder
         """
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.batch_mode = batch_mode
+        self._api_key = api_key
+        self._model_name = model
+        self._generation_config = {
+            "max_output_tokens": 1000,
+            "temperature": 0.7
+        }
+
+        # Answers for near-duplicate queries over an identical context are reused
+        self.embedder = embedder
+        self._encode_query = encode_query or self._embed_query
+        self.response_cache = None
+        if embedder is not None:
+            self.response_cache = QueryCache(
+                dim=embedder.get_sentence_embedding_dimension(),
+                threshold=cache_threshold,
+                max_entries=cache_size,
+                ttl=cache_ttl
+            )
         logger.info("Initializing Gemini response generator...")
         try:
             # Configure Gemini with API key
-            genai.configure(api_key=api_key)
+            genai.configure(api_key=api_key, transport=transport)
             
             # Initialize model with safety settings
             self.model = genai.GenerativeModel(
                 model_name=model,
-                safety_settings={
-                    'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
-                    'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE',
-                    'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_NONE',
-                    'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_NONE'
-                },
-                generation_config={
-                    "max_output_tokens": 1000,
-                    "temperature": 0.7
-                }
+                safety_settings=self._SAFETY_SETTINGS,
+                generation_config=self._generation_config
             )
             logger.info("Successfully connected to %s", model)
         except Exception as e:
@@ -58,14 +142,25 @@ class ResponseGenerator:
 4. Keep responses concise (50-100 words)
 5. Format responses with bullet points when appropriate"""
 
-    def generate(self, query: str, context: str, max_retries: int = 3) -> str:
+        # Invariant prompt head, byte-identical on every request so providers with
+        # prefix caching (Gemini implicit caching, vLLM --enable-prefix-caching)
+        # can reuse it; only the context and the trailing question vary
+        self._prompt_prefix = f"""SYSTEM INSTRUCTIONS:
+{self.system_instruction}
+
+CONTEXT DOCUMENTS:
+"""
+        if warmup:
+            self.ping()
+
+    def generate(self, query: str, context: str, max_retries: Optional[int] = None) -> str:
         """
         Generate a response using RAG context
         
         Args:
             query: User's question
             context: Retrieved documents context
-            max_retries: Number of retry attempts
+            max_retries: Number of retry attempts (defaults to self.max_retries)
             
         Returns:
             Generated response or error message
@@ -73,7 +168,13 @@ class ResponseGenerator:
         logger.info("Generating response for query: %s", self._truncate_text(query))
         logger.debug("Context size: %d chars", len(context))
         
+        cache_key, cached = self._cache_lookup(query, context)
+        if cached is not None:
+            return cached
+
         prompt = self._build_prompt(query, context)
+        if max_retries is None:
+            max_retries = self.max_retries
         
         for attempt in range(max_retries):
             try:
@@ -87,61 +188,395 @@ class ResponseGenerator:
                     continue
                 
                 # Validate and format response
-                validated = self._validate_response(response.text, query)
+                validated = self.validate_response(response.text, query)
                 elapsed = time.time() - start_time
                 
                 logger.info("Generated response in %.2fs", elapsed)
-                logger.debug("Final response: %s", self._truncate_text(validated))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Final response: %s", self._truncate_text(validated))
                 
+                self._cache_store(cache_key, validated)
                 return validated
                 
             except Exception as e:
                 logger.error("Attempt %d failed: %s", attempt + 1, str(e))
                 if attempt == max_retries - 1:
                     logger.error("All retries exhausted")
-                    return "⚠️ System error: Please try again later"
+                    return self.ERROR_MESSAGE
                 
                 # Exponential backoff
-                time.sleep(min(2 ** attempt, 5))  # Max 5 second delay
+                time.sleep(self._backoff_delay(attempt, e))
         
         return "🚧 Temporarily unavailable. Please retry."
 
+    async def agenerate(self, query: str, context: str, max_retries: Optional[int] = None) -> str:
+        """
+        Asynchronously generate a response using RAG context
+
+        Same retry and validation behaviour as generate(), but the model call and
+        backoff are awaited so several requests can be in flight on one event loop.
+        generate() stays synchronous: the async gRPC channel is bound to the loop
+        that first used it, so wrapping this in asyncio.run() per call would break.
+
+        Args:
+            query: User's question
+            context: Retrieved documents context
+            max_retries: Number of retry attempts (defaults to self.max_retries)
+
+        Returns:
+            Generated response or error message
+        """
+        logger.info("Generating async response for query: %s", self._truncate_text(query))
+        logger.debug("Context size: %d chars", len(context))
+
+        cache_key, cached = self._cache_lookup(query, context)
+        if cached is not None:
+            return cached
+
+        prompt = self._build_prompt(query, context)
+        if max_retries is None:
+            max_retries = self.max_retries
+
+        for attempt in range(max_retries):
+            try:
+                start_time = time.time()
+                response = await self.model.generate_content_async(prompt)
+
+                if not response.text:
+                    logger.warning("Empty response (attempt %d)", attempt + 1)
+                    continue
+
+                validated = self.validate_response(response.text, query)
+                logger.info("Generated response in %.2fs", time.time() - start_time)
+                self._cache_store(cache_key, validated)
+                return validated
+
+            except Exception as e:
+                logger.error("Attempt %d failed: %s", attempt + 1, str(e))
+                if attempt == max_retries - 1:
+                    logger.error("All retries exhausted")
+                    return self.ERROR_MESSAGE
+
+                await asyncio.sleep(self._backoff_delay(attempt, e))
+
+        return "🚧 Temporarily unavailable. Please retry."
+
+    async def generate_batch(self, pairs: Iterable[Tuple[str, str]],
+                             concurrency: int = 8) -> List[str]:
+        """
+        Generate responses for several (query, context) pairs concurrently
+
+        Args:
+            pairs: (query, context) tuples
+            concurrency: Maximum requests in flight at once
+
+        Returns:
+            Responses in the same order as pairs
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(query: str, context: str) -> str:
+            async with semaphore:
+                return await self.agenerate(query, context)
+
+        return await asyncio.gather(*(run(query, context) for query, context in pairs))
+
+    def generate_stream(self, query: str, context: str) -> Iterator[str]:
+        """
+        Stream a response using RAG context, yielding text chunks as they arrive
+
+        Args:
+            query: User's question
+            context: Retrieved documents context
+
+        Yields:
+            Response text chunks, or a single error message on failure; pass the
+            joined text to finalize_stream() to validate and cache it
+        """
+        logger.info("Streaming response for query: %s", self._truncate_text(query))
+        logger.debug("Context size: %d chars", len(context))
+
+        _, cached = self._cache_lookup(query, context)
+        if cached is not None:
+            yield cached
+            return
+
+        prompt = self._build_prompt(query, context)
+        start_time = time.time()
+
+        try:
+            response = self.model.generate_content(prompt, stream=True)
+            for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+
+            logger.info("Streamed response in %.2fs", time.time() - start_time)
+
+        except Exception as e:
+            logger.error("Streaming failed: %s", str(e))
+            yield self.ERROR_MESSAGE
+
+    async def agenerate_stream(self, query: str, context: str) -> AsyncIterator[str]:
+        """
+        Asynchronously stream a response using RAG context
+
+        Args:
+            query: User's question
+            context: Retrieved documents context
+
+        Yields:
+            Response text chunks, or a single error message on failure; pass the
+            joined text to finalize_stream() to validate and cache it
+        """
+        logger.info("Streaming async response for query: %s", self._truncate_text(query))
+        logger.debug("Context size: %d chars", len(context))
+
+        _, cached = self._cache_lookup(query, context)
+        if cached is not None:
+            yield cached
+            return
+
+        prompt = self._build_prompt(query, context)
+        start_time = time.time()
+
+        try:
+            response = await self.model.generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+
+            logger.info("Streamed response in %.2fs", time.time() - start_time)
+
+        except Exception as e:
+            logger.error("Streaming failed: %s", str(e))
+            yield self.ERROR_MESSAGE
+
+    def finalize_stream(self, text: str, query: str, context: str) -> str:
+        """
+        Validate a fully streamed response and cache the result
+
+        Streaming can't retract chunks already shown, so validation runs once on
+        the accumulated text; callers re-render if the result differs. Answers
+        the stream served from the cache were validated when stored and are
+        returned unchanged.
+
+        Args:
+            text: Concatenated stream output
+            query: User's question
+            context: Context the stream was generated from
+
+        Returns:
+            Validated response (failed streams are passed through unchanged)
+        """
+        # Failed streams end with the error message and are never cached
+        if text.endswith(self.ERROR_MESSAGE):
+            return text
+        cache_key = self._cache_key(query, context)
+        if cache_key is not None and self.response_cache.lookup(*cache_key) == text:
+            return text
+        validated = self.validate_response(text, query)
+        self._cache_store(cache_key, validated)
+        return validated
+
+    def ping(self) -> bool:
+        """
+        Warm the Gemini connection with a cheap token count of the system prompt
+
+        Returns:
+            True if the API answered, False otherwise
+        """
+        try:
+            self.model.count_tokens(self.system_instruction)
+            return True
+        except Exception as e:
+            logger.warning("Gemini warm-up failed: %s", str(e))
+            return False
+
+    def generate_bulk(self, pairs: Iterable[Tuple[str, str]]) -> List[str]:
+        """
+        Generate responses for a non-interactive workload
+
+        Uses the offline Batch API when batch_mode is set, otherwise calls
+        generate() for each pair. Async callers should use generate_batch().
+
+        Args:
+            pairs: (query, context) tuples
+
+        Returns:
+            Responses in the same order as pairs
+        """
+        pairs = list(pairs)
+        if self.batch_mode:
+            return self.generate_batch_offline(pairs)
+        return [self.generate(query, context) for query, context in pairs]
+
+    def generate_batch_offline(self, pairs: Iterable[Tuple[str, str]],
+                               poll_interval: float = 30.0,
+                               timeout: Optional[float] = None) -> List[str]:
+        """
+        Submit (query, context) pairs as one inline Gemini Batch API job
+
+        Batch jobs are billed at a discount and scheduled by the provider, so
+        they suit evaluations and backfills rather than interactive chat.
+        Requires the optional google-genai package; without it, or if the job
+        fails or exceeds timeout, the pairs are answered with generate().
+
+        Args:
+            pairs: (query, context) tuples
+            poll_interval: Seconds between job status checks
+            timeout: Seconds to wait for the job before falling back (None waits)
+
+        Returns:
+            Responses in the same order as pairs
+        """
+        pairs = list(pairs)
+        if not pairs:
+            return []
+
+        try:
+            from google import genai as genai_client
+        except ImportError:
+            logger.warning("google-genai not installed; answering %d queries in realtime", len(pairs))
+            return [self.generate(query, context) for query, context in pairs]
+
+        done_states = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED",
+                       "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+        try:
+            client = genai_client.Client(api_key=self._api_key)
+            # Same generation and safety settings as the realtime model
+            request_config = dict(
+                self._generation_config,
+                safety_settings=[{"category": category, "threshold": threshold}
+                                 for category, threshold in self._SAFETY_SETTINGS.items()]
+            )
+            requests = [
+                {
+                    "contents": [{"role": "user", "parts": [{"text": self._build_prompt(query, context)}]}],
+                    "config": request_config
+                }
+                for query, context in pairs
+            ]
+            job = client.batches.create(model=self._model_name, src=requests)
+            logger.info("Submitted batch job %s with %d requests", job.name, len(requests))
+
+            start_time = time.time()
+            while job.state.name not in done_states:
+                if timeout is not None and time.time() - start_time > timeout:
+                    client.batches.cancel(name=job.name)
+                    raise TimeoutError(f"batch job {job.name} exceeded {timeout:.0f}s")
+                time.sleep(poll_interval)
+                job = client.batches.get(name=job.name)
+
+            if job.state.name != "JOB_STATE_SUCCEEDED":
+                raise RuntimeError(f"batch job {job.name} ended in {job.state.name}")
+
+            results = []
+            # A short response list raises, so the pairs are answered in realtime below
+            # rather than misaligned with their queries
+            for (query, _), item in zip(pairs, job.dest.inlined_responses, strict=True):
+                if item.response is not None and item.response.text:
+                    results.append(self.validate_response(item.response.text, query))
+                else:
+                    logger.error("Batch request failed: %s", getattr(item, "error", None))
+                    results.append(self.ERROR_MESSAGE)
+            logger.info("Batch job %s finished in %.0fs", job.name, time.time() - start_time)
+            return results
+
+        except Exception as e:
+            logger.error("Batch generation failed, answering in realtime: %s", str(e))
+            return [self.generate(query, context) for query, context in pairs]
+
+    def _cache_lookup(self, query: str, context: str) -> Tuple[Optional[tuple], Optional[str]]:
+        """
+        Look up a cached answer for a similar query over the same context
+
+        Returns:
+            (cache key to store a fresh answer under, cached answer or None)
+        """
+        cache_key = self._cache_key(query, context)
+        if cache_key is None:
+            return None, None
+        cached = self.response_cache.lookup(*cache_key)
+        if cached is not None:
+            logger.info("Serving cached response for query: %s", self._truncate_text(query))
+        return cache_key, cached
+
+    def _cache_key(self, query: str, context: str) -> Optional[tuple]:
+        """(query embedding, context hash), or None when answers aren't cached"""
+        if self.response_cache is None:
+            return None
+        try:
+            embedding = self._encode_query(query)
+        except Exception as e:
+            logger.warning("Response cache disabled for this query: %s", str(e))
+            return None
+        return embedding, hashlib.sha1(context.encode('utf-8')).hexdigest()
+
+    def _embed_query(self, query: str) -> "np.ndarray":
+        return self.embedder.encode([query], show_progress_bar=False)[0]
+
+    def _cache_store(self, cache_key: Optional[tuple], response: str):
+        if cache_key is not None and response:
+            embedding, ctx_hash = cache_key
+            self.response_cache.add(embedding, response, key=ctx_hash)
+
+    def _backoff_delay(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """
+        Full-jitter exponential backoff for a failed attempt
+
+        Delays are drawn uniformly from [0, min(retry_delay * 2^attempt, 5)] so
+        concurrent callers don't retry in lockstep; on a 429 the server's
+        requested delay is honoured as a lower bound.
+        """
+        delay = random.uniform(0, min(self.retry_delay * 2 ** attempt, 5))
+        if isinstance(error, google_exceptions.ResourceExhausted):
+            server_delay = self._server_retry_delay(error)
+            if server_delay is not None:
+                logger.warning("Rate limited; server asked to wait %.1fs", server_delay)
+                delay = max(delay, server_delay)
+        return delay
+
+    @staticmethod
+    def _server_retry_delay(error: Exception) -> Optional[float]:
+        """Extract a RetryInfo delay from an API error (gRPC protos or REST dicts)"""
+        for detail in getattr(error, "details", None) or ():
+            if isinstance(detail, dict):
+                if detail.get("@type", "").endswith("RetryInfo") and "retryDelay" in detail:
+                    try:
+                        return float(str(detail["retryDelay"]).rstrip("s"))
+                    except ValueError:
+                        continue
+            elif hasattr(detail, "retry_delay"):
+                return detail.retry_delay.seconds + detail.retry_delay.nanos / 1e9
+        return None
+
     def _build_prompt(self, query: str, context: str) -> str:
         """Construct the RAG prompt template"""
-        return f"""SYSTEM INSTRUCTIONS:
-{self.system_instruction}
-
-CONTEXT DOCUMENTS:
-{context}
+        return f"""{self._prompt_prefix}{context}
 
 USER QUESTION:
 {query}
 
 YOUR RESPONSE (STRICTLY based on context):"""
 
-    def _validate_response(self, text: str, query: str) -> str:
+    def validate_response(self, text: str, query: str) -> str:
         """Clean and validate the generated response"""
         # Remove common hallucinations
-        replacements = [
-            ("as an AI", ""),
-            ("I don't have personal opinions", "The documents don't specify"),
-            ("my knowledge cutoff", "the available documents"),
-            ("in general", "specifically"),
-            ("typically", "in this case")
-        ]
-        
-        for phrase, replacement in replacements:
-            if phrase.lower() in text.lower():
-                logger.warning("Corrected phrase: %s", phrase)
-                text = text.replace(phrase, replacement)
+        text = self._REPLACEMENT_RE.sub(self._replace_phrase, text)
         
         # Ensure response stays on topic
-        if not any(word in text.lower() for word in query.lower().split()[:3]):
+        lowered = text.lower()
+        if not any(word in lowered for word in query.lower().split()[:3]):
             logger.warning("Possible off-topic response")
             text = "Not found in documents. Please rephrase your question."
         
         return text.strip()[:1500]  # Hard length limit
 
+    def _replace_phrase(self, match: re.Match) -> str:
+        phrase = match.group(0)
+        logger.warning("Corrected phrase: %s", phrase)
+        return self._REPLACEMENTS[phrase]
+
     def _truncate_text(self, text: str, length: int = 100) -> str:
         """Helper for logging long texts"""
         return text[:length] + ("..." if len(text) > length else "")
@@ -149,11 +584,16 @@ YOUR RESPONSE (STRICTLY based on context):"""
 
 # Example usage pattern:
 if __name__ == "__main__":
+    setup_logging()
     try:
         # Initialize with config
+        config = get_config()
         generator = ResponseGenerator(
-            api_key=Config().GEMINI_API_KEY,
-            model=Config().GEMINI_MODEL
+            api_key=config.GEMINI_API_KEY,
+            model=config.GEMINI_MODEL,
+            transport=config.GEMINI_TRANSPORT,
+            max_retries=config.MAX_RETRIES,
+            retry_delay=config.RETRY_DELAY
         )
         
         # Test generation
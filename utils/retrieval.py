@@ -2,30 +2,203 @@
 import faiss
 import numpy as np
 import pickle
+import json
+import re
 import os
+import atexit
+import hashlib
 import logging
-from typing import Dict, List
+import functools
+from collections.abc import Sequence
+from typing import Callable, Dict, List, Optional, Tuple
+import pyarrow as pa
 from sentence_transformers import SentenceTransformer
-from config import Config
+from config import get_config
 from utils.file_processor import FileProcessor
+from utils.cache import LRUCache, QueryCache
 
 logger = logging.getLogger(__name__)
 
+def _quantized_onnx_file() -> str:
+    """Pick the int8 ONNX export matching this CPU (VNNI dot products when available)"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            if "avx512_vnni" in f.read():
+                return "onnx/model_qint8_avx512_vnni.onnx"
+    except OSError:
+        pass
+    return "onnx/model_quint8_avx2.onnx"
+
+def _load_cuda_embedder(model_name: str) -> Optional[Tuple[SentenceTransformer, str]]:
+    """Load the encoder on the GPU in fp16, or None without CUDA or if fp16 output is unusable"""
+    try:
+        import torch
+        if not torch.cuda.is_available():
+            return None
+        embedder = SentenceTransformer(model_name, device="cuda")
+        embedder.half()
+        # fp16 can overflow on some inputs; check a sample encodes to finite values
+        sample = embedder.encode(["warm-up sentence for the fp16 check"], show_progress_bar=False)
+        if not np.isfinite(sample).all():
+            logger.warning("fp16 encoder produced non-finite values, using fp32 on CUDA")
+            embedder.float()
+            return embedder, "cuda:fp32"
+        return embedder, "cuda:fp16"
+    except Exception as e:
+        logger.warning("CUDA encoder unavailable, using CPU: %s", str(e))
+        return None
+
+def _load_embedder(model_name: str, backend: str, onnx_file: str = "") -> Tuple[SentenceTransformer, str]:
+    """
+    Load the fastest available encoder for model_name
+
+    Returns:
+        (encoder, identifier of the weights/precision actually loaded); vectors
+        from encoders with different identifiers aren't interchangeable
+    """
+    # A GPU outruns any CPU backend by a wide margin
+    loaded = _load_cuda_embedder(model_name)
+    if loaded is not None:
+        return loaded
+
+    if backend == "onnx":
+        try:
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = os.cpu_count() or 1
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            model_kwargs = {"provider": "CPUExecutionProvider", "session_options": options}
+        except Exception as e:
+            logger.warning("ONNX backend unavailable, falling back to PyTorch: %s", str(e))
+            return SentenceTransformer(model_name), "torch"
+
+        # Prefer the int8 export, then the FP32 export, then PyTorch
+        for file_name in (onnx_file or _quantized_onnx_file(), None):
+            kwargs = dict(model_kwargs, file_name=file_name) if file_name else model_kwargs
+            try:
+                embedder = SentenceTransformer(model_name, backend="onnx", model_kwargs=kwargs)
+                logger.debug("Loaded ONNX encoder %s", file_name or "onnx/model.onnx")
+                return embedder, f"onnx:{file_name or 'onnx/model.onnx'}"
+            except Exception as e:
+                logger.warning("Could not load ONNX encoder %s: %s",
+                               file_name or "onnx/model.onnx", str(e))
+        logger.warning("ONNX backend unavailable, falling back to PyTorch")
+    return SentenceTransformer(model_name), "torch"
+
+def _split_by_tokens(text: str, tokenizer, size: int, overlap: int) -> List[Tuple[int, int]]:
+    """Character spans of windows of size tokens, consecutive windows sharing overlap tokens"""
+    try:
+        offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True,
+                            verbose=False)["offset_mapping"]
+    except (NotImplementedError, KeyError, TypeError):
+        # Slow tokenizers have no offset mapping; fall back to whitespace words
+        offsets = [match.span() for match in re.finditer(r'\S+', text)]
+
+    spans = []
+    step = max(1, size - overlap)
+    for start in range(0, len(offsets), step):
+        window = offsets[start:start + size]
+        spans.append((window[0][0], window[-1][1]))
+        if start + size >= len(offsets):
+            break
+    return spans
+
+@functools.lru_cache(maxsize=None)
+def get_embedder(model_name: str, backend: str = "onnx",
+                 onnx_file: str = "") -> Tuple[SentenceTransformer, str]:
+    """
+    Load an encoder once per process; every component asking for the same model shares it
+
+    Returns:
+        (encoder, identifier of what was loaded), the pair VectorDB accepts
+    """
+    return _load_embedder(model_name, backend, onnx_file)
+
+class _ArrowColumn(Sequence):
+    """Read-only list view over an Arrow column, converting single rows on access"""
+
+    def __init__(self, column, strip_nulls: bool = False):
+        self._column = column
+        self._strip_nulls = strip_nulls
+
+    def __len__(self) -> int:
+        return len(self._column)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = int(idx)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        value = self._column[idx].as_py()
+        if self._strip_nulls:
+            # Struct rows carry every field; drop the ones this record never had
+            value = {key: val for key, val in value.items() if val is not None}
+        return value
+
+def _is_mapped(path: str) -> Optional[bool]:
+    """Whether this process has path memory-mapped (None where /proc/self/maps is unavailable)"""
+    try:
+        with open("/proc/self/maps") as f:
+            maps = f.read()
+    except OSError:
+        return None
+    return os.path.realpath(path) in maps
+
+def _atomic_write(path: str, write: Callable[[str], None]):
+    """Write via a temporary file and rename it over path, so readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
 class VectorDB:
-    def __init__(self):
+    _INDEX_TYPES = ("flat", "sq8", "pq", "hnsw", "ivfpq")
+    # Bump when stored vectors or documents change shape; mismatching indexes are rebuilt
+    _INDEX_FORMAT_VERSION = 1
+
+    def __init__(self, embedder: Optional[Tuple[SentenceTransformer, str]] = None):
         logger.info("Initializing VectorDB...")
-        config = Config()
-        self.embedder = SentenceTransformer(config.EMBEDDING_MODEL)
-        logger.info("Loaded embedding model: %s", Config.EMBEDDING_MODEL)
+        self.config = get_config()
+        # An injected (encoder, identifier) pair normally comes from get_embedder()
+        self.embedder, encoder = embedder or get_embedder(self.config.EMBEDDING_MODEL,
+                                                          self.config.EMBEDDING_BACKEND,
+                                                          self.config.EMBEDDING_ONNX_FILE)
+        # Recorded with the index: query vectors must come from the encoder that built it
+        self._encoder = f"{self.config.EMBEDDING_MODEL}/{encoder}"
+        logger.info("Loaded embedding model: %s (%s backend on %s)",
+                   self.config.EMBEDDING_MODEL, self.embedder.backend, self.embedder.device)
+        
+        # FAISS parallelises across the queries of one search call
+        faiss.omp_set_num_threads(os.cpu_count() or 1)
         
         self.processor = FileProcessor()
         self.index = None
         self.documents = []
         self.metadata = []
+        self.embeddings = None
         self.embedding_dim = 384
+        self.query_cache = QueryCache(
+            path=f"{self.config.VECTOR_DB_PATH}_qcache",
+            dim=self.embedding_dim,
+            threshold=self.config.QUERY_CACHE_THRESHOLD,
+            max_entries=self.config.QUERY_CACHE_SIZE
+        )
+        atexit.register(self.query_cache.save)
+        # Exact repeats skip the encoder, and the search too while the index is unchanged
+        self._embed_cache = LRUCache(self.config.EMBED_CACHE_SIZE)
+        self._result_cache = LRUCache(self.config.RESULT_CACHE_SIZE)
+        self._index_generation = 0
+        # Content digests of indexed documents, so duplicates are embedded once
+        self._doc_hashes = set()
+        # Ingested file name -> size/mtime, to find files added since the last save
+        self._manifest = {}
+        # Format the loaded index was built with (None: unknown, so rebuild)
+        self._stored_format = None
         
-        os.makedirs(Config.VECTOR_DB_PATH, exist_ok=True)
-        os.makedirs(Config.DOCUMENTS_PATH, exist_ok=True)
+        os.makedirs(self.config.VECTOR_DB_PATH, exist_ok=True)
+        os.makedirs(self.config.DOCUMENTS_PATH, exist_ok=True)
         logger.info("Ensured directory structure exists")
         
         if self._index_exists():
@@ -33,11 +206,24 @@ class VectorDB:
             self._load_index()
         else:
             logger.warning("No existing FAISS index found")
+        
+        if self.index is not None and self.config.WARMUP:
+            self.warmup()
+
+    def warmup(self):
+        """Run one throwaway encode and search so the first user query skips cold start"""
+        try:
+            # Initializes lazy weights/CUDA context and pages in the index
+            self.embedder.encode(["warmup"], convert_to_numpy=True, show_progress_bar=False)
+            self.index.search(np.zeros((1, self.embedding_dim), dtype='float32'), 1)
+            logger.debug("Warm-up encode and search complete")
+        except Exception as e:
+            logger.warning("Warm-up failed: %s", str(e))
 
     def _index_exists(self) -> bool:
-        exists = all([
-            os.path.exists(f"{Config.VECTOR_DB_PATH}/index.faiss"),
-            os.path.exists(f"{Config.VECTOR_DB_PATH}/metadata.pkl")
+        exists = os.path.exists(f"{self.config.VECTOR_DB_PATH}/index.faiss") and any([
+            os.path.exists(f"{self.config.VECTOR_DB_PATH}/docs.arrow"),
+            os.path.exists(f"{self.config.VECTOR_DB_PATH}/metadata.pkl")
         ])
         logger.debug("Index existence check: %s", exists)
         return exists
@@ -45,13 +231,51 @@ class VectorDB:
     def _load_index(self):
         try:
             logger.info("Loading FAISS index...")
-            self.index = faiss.read_index(f"{Config.VECTOR_DB_PATH}/index.faiss")
-            with open(f"{Config.VECTOR_DB_PATH}/metadata.pkl", 'rb') as f:
-                self.documents, self.metadata = pickle.load(f)
+            index_path = f"{self.config.VECTOR_DB_PATH}/index.faiss"
+            try:
+                # Demand-page the stored codes instead of copying the file into RAM:
+                # MMAP_IFC covers flat/SQ/PQ/HNSW storage, MMAP the IVF inverted lists
+                self.index = faiss.read_index(
+                    index_path,
+                    faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+                )
+                if _is_mapped(index_path) is False:
+                    logger.warning("FAISS index was read into RAM instead of memory-mapped")
+            except Exception as e:
+                logger.debug("Memory-mapped index load unavailable: %s", str(e))
+                self.index = faiss.read_index(index_path)
+            self._load_documents()
+            self._load_doc_hashes()
+            self._load_manifest()
+            self._load_embeddings()
+            self._configure_search()
+            self._index_generation += 1
             logger.info("Successfully loaded index with %d documents", len(self.documents))
         except Exception as e:
             logger.error("Failed loading index: %s", str(e))
             self.index = None
+            self.documents, self.metadata = [], []
+            self._doc_hashes = set()
+            self._manifest, self._stored_format = {}, None
+
+    def _load_documents(self):
+        arrow_path = f"{self.config.VECTOR_DB_PATH}/docs.arrow"
+        if os.path.exists(arrow_path):
+            # Uncompressed IPC over a memory map: columns reference the file's pages
+            table = pa.ipc.open_file(pa.memory_map(arrow_path, 'r')).read_all()
+            self.documents = _ArrowColumn(table.column("text"))
+            self.metadata = _ArrowColumn(table.column("metadata"), strip_nulls=True)
+        else:
+            # Indexes saved before the Arrow layout
+            with open(f"{self.config.VECTOR_DB_PATH}/metadata.pkl", 'rb') as f:
+                self.documents, self.metadata = pickle.load(f)
+
+    def load_or_create_index(self) -> bool:
+        if self.index is not None and len(self.documents) > 0:
+            logger.info("Using loaded index with %d documents", len(self.documents))
+            self.update_index()
+            return self.index is not None
+        return self.add_documents() and self.index is not None
 
     def add_documents(self) -> bool:
         logger.info("Starting document ingestion process")
@@ -67,58 +291,387 @@ class VectorDB:
         self._create_new_index()
         return True
 
-    def _process_new_documents(self) -> bool:
-        logger.info("Processing new documents from %s", Config.DOCUMENTS_PATH)
-        success_count = 0
-        file_list = os.listdir(Config.DOCUMENTS_PATH)
-        logger.debug("Found %d files in documents directory", len(file_list))
+    def update_index(self) -> bool:
+        """
+        Bring a loaded index up to date with the documents folder
+
+        New files are encoded and appended without touching existing vectors
+        (compressed indexes keep their trained quantizers). Changed or deleted
+        files can't be removed in place, and an index built in another format
+        (see _index_format) can't be extended, so both trigger a full rebuild.
+
+        Returns:
+            True if the index changed
+        """
+        if self._stored_format != self._index_format():
+            logger.warning("Index format %s does not match %s; rebuilding index",
+                           self._stored_format, self._index_format())
+            return self._rebuild_index()
+
+        current = self._scan_documents()
+        indexed = {name: entry for name, entry in self._manifest.items() if entry.get("chunks")}
+        stale = [name for name, entry in indexed.items() if self._changed(entry, current.get(name))]
+        if stale:
+            logger.warning("%d indexed documents changed or were removed; rebuilding index", len(stale))
+            return self._rebuild_index()
+
+        # Forget unindexed files that were deleted
+        self._manifest = {name: entry for name, entry in self._manifest.items()
+                          if name in current or entry.get("chunks")}
+        # Files that gave no chunks last time (empty, unreadable, duplicate) are
+        # only retried once they change
+        new_files = sorted(name for name, state in current.items()
+                           if name not in indexed and self._changed(self._manifest.get(name), state))
+        if not new_files:
+            logger.debug("Index is up to date with %s", self.config.DOCUMENTS_PATH)
+            return False
+
+        logger.info("Found %d new or changed documents", len(new_files))
+        new_docs = self._read_documents(new_files)
+        if not new_docs:
+            self._save_manifest()
+            return False
+
+        # Only now pay for copying the memory-mapped index and store into RAM
+        self._materialize()
+        start = len(self.documents)
+        self._chunk_documents(new_docs)
+        if len(self.documents) == start:
+            self._save_manifest()
+            return False
+
+        new_embeddings = self._encode_documents(self.documents[start:])
+        self.index.add(new_embeddings)
+        if self.embeddings is not None:
+            self.embeddings = np.concatenate([self.embeddings, new_embeddings])
+        self._index_generation += 1
+        logger.info("FAISS index now holds %d vectors", self.index.ntotal)
+
+        # Cached results point at the previous index contents
+        self.query_cache.clear()
+        self._save_index()
+        return True
+
+    def _rebuild_index(self) -> bool:
+        self.index, self.embeddings = None, None
+        self.documents, self.metadata = [], []
+        self._doc_hashes, self._manifest, self._stored_format = set(), {}, None
+        if not self._process_new_documents():
+            logger.error("No documents were processed successfully")
+            return False
+        self._create_new_index()
+        return True
+
+    def _materialize(self):
+        """Copy memory-mapped state into RAM so it can be appended to and saved over"""
+        self.index = faiss.read_index(f"{self.config.VECTOR_DB_PATH}/index.faiss")
+        self._configure_search()
+        self.documents, self.metadata = list(self.documents), list(self.metadata)
+        if self.embeddings is not None:
+            self.embeddings = np.array(self.embeddings)
+
+    def _scan_documents(self) -> Dict[str, Dict[str, int]]:
+        """Stat state of every file in the documents folder the processor can read"""
+        formats = self.processor.supported_formats
+        with os.scandir(self.config.DOCUMENTS_PATH) as entries:
+            return {entry.name: self._file_state(entry.stat())
+                    for entry in entries
+                    if entry.is_file() and os.path.splitext(entry.name)[1].lower() in formats}
+
+    @staticmethod
+    def _file_state(stat: os.stat_result) -> Dict[str, int]:
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    @staticmethod
+    def _changed(entry: Optional[Dict], state: Optional[Dict]) -> bool:
+        if entry is None or state is None:
+            return True
+        return entry["size"] != state["size"] or entry["mtime_ns"] != state["mtime_ns"]
+
+    def _index_format(self) -> Dict:
+        """Settings an index must have been built with to be searched and extended as is"""
+        return {
+            "version": self._INDEX_FORMAT_VERSION,
+            "metric": "inner_product",
+            "encoder": self._encoder,
+            # Whole-file (pre-chunking) and differently chunked stores are re-ingested
+            "chunk_size": self.config.CHUNK_SIZE,
+            "chunk_overlap": self.config.CHUNK_OVERLAP
+        }
+
+    def _load_manifest(self):
+        path = f"{self.config.VECTOR_DB_PATH}/manifest.json"
+        # Indexes saved without a manifest have an unknown format and are rebuilt
+        self._manifest, self._stored_format = {}, None
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            self._manifest = manifest.get("files", {})
+            self._stored_format = manifest.get("format")
+
+    def _save_manifest(self):
+        manifest = {"format": self._index_format(), "files": self._manifest}
+        def write(tmp: str):
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+        _atomic_write(f"{self.config.VECTOR_DB_PATH}/manifest.json", write)
+        self._stored_format = manifest["format"]
+
+    def _process_new_documents(self, file_list: Optional[List[str]] = None) -> bool:
+        if file_list is None:
+            file_list = sorted(self._scan_documents())
+        new_docs = self._read_documents(file_list)
+        self._chunk_documents(new_docs)
+        return len(new_docs) > 0
+
+    def _read_documents(self, file_list: List[str]) -> List[Tuple[str, str]]:
+        """
+        Extract text from files, recording every attempt in the manifest
+
+        Returns:
+            (file name, text) of files with new content, duplicates excluded
+        """
+        logger.info("Processing new documents from %s", self.config.DOCUMENTS_PATH)
+        logger.debug("Found %d files to process", len(file_list))
+        new_docs = []
         
         for file_name in file_list:
-            file_path = os.path.join(Config.DOCUMENTS_PATH, file_name)
+            file_path = os.path.join(self.config.DOCUMENTS_PATH, file_name)
             logger.debug("Processing %s", file_name)
             try:
+                # Failures are recorded too ("chunks": 0), so they aren't retried until changed
+                self._manifest[file_name] = dict(self._file_state(os.stat(file_path)), chunks=0)
                 text = self.processor.process_file(file_path)
                 if text:
-                    self.documents.append(text)
-                    self.metadata.append({"source": file_name})
-                    success_count += 1
-                    logger.debug("Added document %s (%d chars)", file_name, len(text))
+                    digest = self._content_hash(text)
+                    if digest in self._doc_hashes:
+                        logger.info("Skipping %s: duplicate of an indexed document", file_name)
+                        continue
+                    self._doc_hashes.add(digest)
+                    new_docs.append((file_name, text))
             except Exception as e:
                 logger.error("Failed processing %s: %s", file_name, str(e))
         
-        logger.info("Processed %d/%d files successfully", success_count, len(file_list))
-        return success_count > 0
+        logger.info("Processed %d/%d files successfully", len(new_docs), len(file_list))
+        return new_docs
+
+    def _chunk_documents(self, new_docs: List[Tuple[str, str]]):
+        for file_name, text in new_docs:
+            n_chunks = self._add_chunks(text, file_name)
+            self._manifest[file_name]["chunks"] = n_chunks
+            logger.debug("Added document %s (%d chars, %d chunks)",
+                         file_name, len(text), n_chunks)
+
+    def _add_chunks(self, text: str, source: str) -> int:
+        """Split a document into overlapping token windows and append them as documents"""
+        # Leave room for the [CLS]/[SEP] tokens so no chunk is truncated by the encoder
+        size = min(self.config.CHUNK_SIZE, self.embedder.max_seq_length - 2)
+        spans = _split_by_tokens(text, self.embedder.tokenizer, size, self.config.CHUNK_OVERLAP)
+        doc_start = len(self.documents)
+        for chunk_id, (start, end) in enumerate(spans):
+            self.documents.append(text[start:end])
+            self.metadata.append({
+                "source": source,
+                "chunk_id": chunk_id,
+                "chunk_len": end - start,
+                "char_start": start,
+                # Parent document: its chunks are stored contiguously from doc_start
+                "doc_start": doc_start,
+                "doc_chunks": len(spans)
+            })
+        return len(spans)
+
+    def expand_chunk(self, meta: Dict, window: int = 1) -> Optional[str]:
+        """
+        Rejoin a retrieved chunk with up to window neighbours on each side
+
+        Returns:
+            The contiguous source text, or None if meta has no chunk position
+        """
+        if "doc_start" not in meta:
+            return None
+        first = max(0, meta["chunk_id"] - window)
+        last = min(meta["doc_chunks"], meta["chunk_id"] + window + 1)
+        parts, end = [], None
+        for idx in range(meta["doc_start"] + first, meta["doc_start"] + last):
+            text, chunk = self.documents[idx], self.metadata[idx]
+            # Drop the characters already covered by the previous window's overlap
+            skip = max(0, end - chunk["char_start"]) if end is not None else 0
+            parts.append(text[skip:])
+            end = chunk["char_start"] + chunk["chunk_len"]
+        return "".join(parts)
 
     def _create_new_index(self):
         logger.info("Creating new FAISS index...")
-        logger.debug("Encoding %d documents...", len(self.documents))
-        embeddings = self.embedder.encode(self.documents, show_progress_bar=False)
+        embeddings = self._encode_documents(self.documents)
+        
+        self.index = self._build_index(embeddings)
+        # Exact indexes never rerank, so only compressed ones keep the vectors
+        self.embeddings = None if self._is_exact(self.index) else embeddings
+        self._configure_search()
+        self._index_generation += 1
+        logger.info("FAISS index created with %d vectors", self.index.ntotal)
+        
+        # Cached results point at the previous index contents
+        self.query_cache.clear()
+        self._save_index()
+
+    def _encode_documents(self, texts: List[str]) -> np.ndarray:
+        logger.debug("Encoding %d documents...", len(texts))
+        # Large batches keep a GPU saturated; on CPU they only add memory
+        batch_size = 256 if self.embedder.device.type == "cuda" else 32
+        embeddings = self.embedder.encode(texts, batch_size=batch_size,
+                                          convert_to_numpy=True, normalize_embeddings=True,
+                                          show_progress_bar=False)
         logger.debug("Embedding generation complete")
         
+        # Unit vectors make inner product equal cosine similarity
         embeddings = np.array(embeddings).astype('float32')
+        faiss.normalize_L2(embeddings)
         if embeddings.shape[1] != self.embedding_dim:
             logger.error("Embedding dimension mismatch! Expected %d, got %d", 
                         self.embedding_dim, embeddings.shape[1])
             raise ValueError("Embedding dimension mismatch")
-        
-        logger.debug("Initializing FAISS index...")
-        self.index = faiss.IndexFlatL2(self.embedding_dim)
-        self.index.add(embeddings)
-        logger.info("FAISS index created with %d vectors", self.index.ntotal)
-        
-        self._save_index()
+        return embeddings
+
+    def _index_type(self, n: int) -> str:
+        """Resolve Config.FAISS_INDEX_TYPE, picking a tier by corpus size for 'auto'"""
+        index_type = self.config.FAISS_INDEX_TYPE
+        if index_type in self._INDEX_TYPES:
+            return index_type
+        if index_type != "auto":
+            logger.warning("Unknown FAISS_INDEX_TYPE %r, choosing by corpus size", index_type)
+        # A flat scan is already fast on small corpora and needs no training
+        if n < self.config.FAISS_SQ_THRESHOLD:
+            return "flat"
+        if n < self.config.FAISS_HNSW_THRESHOLD:
+            return "sq8"
+        if n < self.config.FAISS_IVF_THRESHOLD:
+            return "hnsw"
+        return "ivfpq"
+
+    def _build_index(self, embeddings: np.ndarray) -> faiss.Index:
+        n = len(embeddings)
+        index_type = self._index_type(n)
+        if index_type == "hnsw":
+            # Graph search is sublinear and needs no training; vectors stay exact
+            logger.debug("Building HNSW%d index on %d vectors...", self.config.FAISS_HNSW_M, n)
+            index = faiss.IndexHNSWFlat(self.embedding_dim, self.config.FAISS_HNSW_M,
+                                        faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.config.FAISS_HNSW_EF_CONSTRUCTION
+        elif index_type != "flat":
+            # int8 codes are 4x smaller than float32 and PQ codes ~32x; the small
+            # recall loss is recovered by reranking candidates on the exact vectors
+            index = self._train_quantized_index(index_type, embeddings)
+            if index is None:
+                index_type = "flat"
+        if index_type == "flat":
+            logger.debug("Initializing flat FAISS index...")
+            index = faiss.IndexFlatIP(self.embedding_dim)
+        index.add(embeddings)
+        return index
+
+    @staticmethod
+    def _is_exact(index: faiss.Index) -> bool:
+        """Flat and HNSWFlat indexes store full vectors; the others store lossy codes"""
+        return isinstance(index, (faiss.IndexFlat, faiss.IndexHNSWFlat))
+
+    def _train_quantized_index(self, index_type: str, embeddings: np.ndarray):
+        """Train a compressed index, or return None if the corpus is too small to train it"""
+        if index_type == "sq8":
+            index = faiss.IndexScalarQuantizer(self.embedding_dim, faiss.ScalarQuantizer.QT_8bit,
+                                               faiss.METRIC_INNER_PRODUCT)
+        else:
+            factory = (self.config.FAISS_PQ_INDEX_FACTORY if index_type == "pq"
+                       else self.config.FAISS_INDEX_FACTORY)
+            index = faiss.index_factory(self.embedding_dim, factory, faiss.METRIC_INNER_PRODUCT)
+        try:
+            logger.debug("Training %s index on %d vectors...", index_type, len(embeddings))
+            index.train(embeddings)
+            return index
+        except Exception as e:
+            logger.warning("Could not train %s index, using a flat index: %s", index_type, str(e))
+            return None
+
+    def _configure_search(self):
+        if isinstance(self.index, faiss.IndexHNSW):
+            self.index.hnsw.efSearch = self.config.FAISS_HNSW_EF_SEARCH
+            logger.debug("Set HNSW efSearch=%d", self.config.FAISS_HNSW_EF_SEARCH)
+            return
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            ivf.nprobe = self.config.FAISS_NPROBE
+            logger.debug("Set IVF nprobe=%d", self.config.FAISS_NPROBE)
+
+    def _load_embeddings(self):
+        # Exact vectors are only used to rerank candidates from a compressed index
+        path = f"{self.config.VECTOR_DB_PATH}/embeddings.npy"
+        if not self._is_exact(self.index) and os.path.exists(path):
+            self.embeddings = np.load(path, mmap_mode='r')
+            logger.debug("Memory-mapped %d embeddings for reranking", len(self.embeddings))
+
+    def rerank(self, q_emb: np.ndarray, cand_embs: np.ndarray, top_k: int) -> np.ndarray:
+        """Return positions of the top_k candidates by cosine similarity, best first"""
+        q = np.ascontiguousarray(q_emb, dtype=np.float32).reshape(-1)
+        cand = np.ascontiguousarray(cand_embs, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        norms = np.linalg.norm(cand, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        scores = (cand / norms) @ q
+
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return np.empty(0, dtype=np.int64)
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        return top[np.argsort(-scores[top])]
 
     def _save_index(self):
         try:
             logger.debug("Saving index to disk...")
-            faiss.write_index(self.index, f"{Config.VECTOR_DB_PATH}/index.faiss")
-            with open(f"{Config.VECTOR_DB_PATH}/metadata.pkl", 'wb') as f:
-                pickle.dump((self.documents, self.metadata), f)
-            logger.info("Index successfully saved to %s", Config.VECTOR_DB_PATH)
+            path = self.config.VECTOR_DB_PATH
+            _atomic_write(f"{path}/index.faiss", lambda tmp: faiss.write_index(self.index, tmp))
+            if self.embeddings is not None:
+                _atomic_write(f"{path}/embeddings.npy", lambda tmp: self._write_array(tmp, self.embeddings))
+            elif os.path.exists(f"{path}/embeddings.npy"):
+                # Left over from a compressed index this one replaced
+                os.remove(f"{path}/embeddings.npy")
+            
+            _atomic_write(f"{path}/docs.arrow", self._write_documents)
+            hashes = np.frombuffer(b"".join(sorted(self._doc_hashes)), dtype=np.uint8).reshape(-1, 16)
+            _atomic_write(f"{path}/doc_hashes.npy", lambda tmp: self._write_array(tmp, hashes))
+            self._save_manifest()
+            logger.info("Index successfully saved to %s", self.config.VECTOR_DB_PATH)
         except Exception as e:
             logger.error("Failed saving index: %s", str(e))
             raise
 
+    @staticmethod
+    def _content_hash(text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def _load_doc_hashes(self):
+        path = f"{self.config.VECTOR_DB_PATH}/doc_hashes.npy"
+        if os.path.exists(path):
+            # Stored as raw uint8 rows; bytes dtypes would strip trailing NULs
+            self._doc_hashes = {row.tobytes() for row in np.load(path)}
+        else:
+            self._doc_hashes = {self._content_hash(text) for text in self.documents}
+
+    def _write_documents(self, path: str):
+        # Text as one large_string column, metadata as a struct column
+        table = pa.table({
+            "text": pa.array(list(self.documents), type=pa.large_string()),
+            "metadata": pa.array(list(self.metadata))
+        })
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    @staticmethod
+    def _write_array(path: str, array: np.ndarray):
+        # A file object stops np.save from appending .npy to the temporary name
+        with open(path, 'wb') as f:
+            np.save(f, array)
+
     # def query(self, query_text: str, k: int = 3) -> Dict:
     #     logger.info("Processing query: '%s'", query_text[:50] + ("..." if len(query_text) > 50 else ""))
     #     if not self.index:
@@ -158,31 +711,89 @@ class VectorDB:
 
     # In retrieval.py, modify the query method:
     def query(self, query_text: str, k: int = 3) -> Dict:
+        return self.query_batch([query_text], k)[0]
+
+    def embed_query(self, query_text: str) -> np.ndarray:
+        """Embed one query through the shared embedding cache (no encode if query() saw it)"""
+        key = hashlib.blake2b(query_text.encode('utf-8'), digest_size=16).digest()
+        return self._encode_queries([query_text], [key])[0]
+
+    def query_batch(self, query_texts: List[str], k: int = 3) -> List[Dict]:
+        """Retrieve the top k documents for several queries with one encode and one search"""
         try:
-            query_embed = self.embedder.encode([query_text])
-            query_embed = np.array(query_embed).astype('float32')
+            text_keys = [hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+                         for text in query_texts]
+            result_keys = [(key, k, self._index_generation) for key in text_keys]
+            query_embeds = self._encode_queries(query_texts, text_keys)
+            
+            # Identical queries hit the exact cache, near-duplicates the semantic one
+            cache_key = k
+            results = [self._result_cache.get(key) for key in result_keys]
+            for i, result in enumerate(results):
+                if result is None:
+                    results[i] = self.query_cache.lookup(query_embeds[i], key=cache_key)
+            misses = [i for i, cached in enumerate(results) if cached is None]
             
             # Ensure k is within bounds
             k = min(k, self.index.ntotal) if self.index.ntotal > 0 else 0
             
-            if k == 0:
-                return {'documents': [], 'metadatas': []}
-                
-            distances, indices = self.index.search(query_embed, k)
+            if misses and k > 0:
+                fetched = self._search(query_embeds[misses], k)
+                for i, result in zip(misses, fetched):
+                    results[i] = result
+                    if result['documents']:
+                        self.query_cache.add(query_embeds[i], result, key=cache_key)
             
-            # Fix the results processing
-            results = {'documents': [], 'metadatas': []}
-            for i in range(len(indices[0])):
-                idx = indices[0][i]
-                if idx >= 0:
-                    results['documents'].append(self.documents[idx])
-                    results['metadatas'].append(self.metadata[idx])
-                    
-            return results
+            # Empty results aren't cached, so documents added later can still match
+            for key, result in zip(result_keys, results):
+                if result is not None and result['documents']:
+                    self._result_cache.put(key, result)
+            return [result or {'documents': [], 'metadatas': []} for result in results]
 
         except Exception as e:
             logger.error("Query processing failed: %s", str(e))
-            return {'documents': [], 'metadatas': []}
+            return [{'documents': [], 'metadatas': []} for _ in query_texts]
+
+    def _encode_queries(self, query_texts: List[str], text_keys: List[bytes]) -> np.ndarray:
+        """Embed queries, reusing cached embeddings for texts seen before"""
+        embeds = [self._embed_cache.get(key) for key in text_keys]
+        missing = [i for i, embed in enumerate(embeds) if embed is None]
+        if missing:
+            encoded = self.embedder.encode([query_texts[i] for i in missing],
+                                           batch_size=64, show_progress_bar=False)
+            for i, embed in zip(missing, np.array(encoded).astype('float32')):
+                embeds[i] = embed
+                self._embed_cache.put(text_keys[i], embed)
+        if not embeds:
+            return np.empty((0, self.embedding_dim), dtype='float32')
+        return np.stack(embeds)
+
+    def _search(self, query_embeds: np.ndarray, k: int) -> List[Dict]:
+        # Compressed indexes over-fetch and rerank on the exact vectors
+        exact = self._is_exact(self.index) or self.embeddings is None
+        fetch = k if exact else min(k * self.config.RERANK_OVERFETCH, self.index.ntotal)
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            # Scores are cosine similarities in [-1, 1], higher is better
+            query_embeds = np.array(query_embeds, dtype='float32')
+            faiss.normalize_L2(query_embeds)
+        # One batched search lets FAISS spread the queries across OpenMP threads
+        distances, indices = self.index.search(query_embeds, fetch)
+        
+        results = []
+        for query_embed, row in zip(query_embeds, indices):
+            candidates = row[row >= 0]
+            if not exact and len(candidates) > 0:
+                # Sorted ids read the memory-mapped vectors sequentially
+                candidates = np.sort(candidates)
+                candidates = candidates[self.rerank(query_embed, self.embeddings[candidates], k)]
+            
+            # Fix the results processing
+            result = {'documents': [], 'metadatas': []}
+            for idx in candidates:
+                result['documents'].append(self.documents[idx])
+                result['metadatas'].append(self.metadata[idx])
+            results.append(result)
+        return results
         
         
 # import faiss